@@ -7,15 +7,17 @@ import json
 import html
 import shutil
 import time
+import atexit
+import signal
+import select
 import socket
 import tomllib
 import importlib.util
 from pathlib import Path
+from types import ModuleType
 from subprocess import Popen, PIPE
-from typing import List, Dict, Any, Callable
+from typing import List, Dict, Tuple, Any, Callable, Iterable, Iterator
 from urllib.request import Request, urlopen
-from html.parser import HTMLParser
-from datetime import datetime
 from dataclasses import dataclass
 
 VERSION = "47"
@@ -25,6 +27,31 @@ USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"
 ORIGINAL = "Original :: "
 CMD_TIMEOUT = 3
 SOCKET_TIMEOUT = 6
+TITLE_CHUNK_SIZE = 4096
+TITLE_MAX_BYTES = 64_000
+
+# Static strings used in the Rofi menu
+_ASTERISK = "<span> * </span>"
+_PROMPT_NAME = f"Clipton v{VERSION}"
+_PROMPT_SHORTCUTS = "Alt+1 Delete | Alt+(2-9) Join | Alt+0 Clear"
+
+# Table to escape text for Rofi markup (same output as html.escape)
+_ESCAPE_TABLE = str.maketrans({
+  "&": "&amp;",
+  "<": "&lt;",
+  ">": "&gt;",
+  '"': "&quot;",
+  "'": "&#x27;",
+})
+
+# Regexes used when rendering the Rofi menu
+# Group 1 is a newline with its surrounding spaces, group 2 is a run of spaces
+_RE_NORMALIZE = re.compile(r"( *\n *)|(  +)")
+_RE_HTTP = re.compile(r"^(https?://)")
+_RE_HTTP_WWW = re.compile(r"^(https?://(www\.)?)")
+
+# Regex to find the title in the first bytes of a page
+_RE_TITLE = re.compile(rb"<title[^>]*>(.*?)</title>", re.I | re.S)
 
 #-----------------
 # SETTINGS
@@ -125,6 +152,12 @@ class Config:
   # Path to the items file
   items_path = config_path / Path("items.json")
 
+  # Path to the log file with the item changes made after the items file was written
+  log_path = config_path / Path("items.log")
+
+  # Path where the log file is moved while the items file is rewritten
+  old_log_path = config_path / Path("items.log.old")
+
   # Path to the settings file
   settings_path = config_path / Path("settings.toml")
 
@@ -141,6 +174,7 @@ class Config:
       Files.mkdir(Config.converters_path)
 
     Files.touch(Config.items_path)
+    Files.touch(Config.log_path)
     Files.touch(Config.settings_path)
 
 #-----------------
@@ -161,15 +195,31 @@ class Files:
     return content
 
   # Write to a file
+  # The content is written in one go and is not synced to disk
   @staticmethod
-  def write(path: Path, content: str) -> None:
-    file = open(path, "w")
-    file.write(content)
-    file.close()
+  def write(path: Path, content: str | bytes) -> None:
+    if isinstance(content, str):
+      content = content.encode("utf-8")
+
+    path.write_bytes(content)
+
+  # Add to the end of a file
+  @staticmethod
+  def append(path: Path, content: str) -> None:
+    with open(path, "ab") as file:
+      file.write(content.encode("utf-8"))
+
+  # Write to a temporary file and move it over the target
+  # This way a crash never leaves a half-written file behind
+  @staticmethod
+  def write_atomic(path: Path, content: str) -> None:
+    tmp = path.with_suffix(".tmp")
+    Files.write(tmp, content)
+    os.replace(tmp, path)
 
   # Read a JSON file and return the
   @staticmethod
-  def read_json(path: Path, hook: Callable[[Any], Any], fallback: str = "[]") -> Any:
+  def read_json(path: Path, hook: Callable[[Any], Any] | None = None, fallback: str = "[]") -> Any:
     content = Files.read(path, fallback)
 
     if hook is not None:
@@ -179,9 +229,9 @@ class Files:
 
   # Write to a JSON file
   @staticmethod
-  def write_json(path: Path, data: Any, default: Callable[[Any], Any]) -> None:
-    content = json.dumps(data, default=default, indent=2)
-    Files.write(Config.items_path, content)
+  def write_json(path: Path, data: Any, default: Callable[[Any], Any] | None = None) -> None:
+    content = json.dumps(data, default=default, separators=(",", ":"))
+    Files.write_atomic(path, content)
 
   # Read a TOML file and return the dictionary
   @staticmethod
@@ -189,10 +239,20 @@ class Files:
     with open(path, "rb") as file:
       return tomllib.load(file)
 
-  # Create a file
+  # Get the modification time of a file in nanoseconds
+  @staticmethod
+  def mtime(path: Path) -> int:
+    try:
+      return path.stat().st_mtime_ns
+    except OSError:
+      return 0
+
+  # Create a file if it doesn't exist
+  # Existing files are left alone so their modification time doesn't change
   @staticmethod
   def touch(path: Path) -> None:
-    path.touch(exist_ok=True)
+    if not path.exists():
+      path.touch()
 
   # Create a directory
   @staticmethod
@@ -213,21 +273,6 @@ class CmdOutput:
     self.code = code
 
 class Utils:
-  # HTML parser to get the title from a URL
-  class TitleParser(HTMLParser):
-    def __init__(self) -> None:
-      HTMLParser.__init__(self)
-      self.match = False
-      self.title = ""
-
-    def handle_starttag(self, tag: str, attributes: List[Any]) -> None:
-      self.match = tag == "title"
-
-    def handle_data(self, data: str) -> None:
-      if self.match:
-        self.title = data
-        self.match = False
-
   # Check if a string contains a space
   @staticmethod
   def space(text: str) -> bool:
@@ -242,7 +287,7 @@ class Utils:
   # Get unix seconts
   @staticmethod
   def get_seconds() -> int:
-    return int(datetime.now().timestamp())
+    return int(time.time())
 
   # Get timeago string based on minutes
   @staticmethod
@@ -263,19 +308,8 @@ class Utils:
   def request(url: str) -> Request:
     return Request(url, headers={"User-Agent": USER_AGENT})
 
-  # Get the content type of a URL
-  @staticmethod
-  def get_url_type(url: str) -> str:
-    try:
-      with urlopen(Utils.request(url)) as r:
-        header = r.headers
-        return str(header.get_content_type())
-
-    except Exception as e:
-      Utils.msg(f"URL Type Exception: {e}")
-      return "none"
-
   # Get the title from a URL
+  # The page is read in chunks until the title is found
   @staticmethod
   def get_title(text: str) -> str:
     http = text.startswith("http://")
@@ -283,12 +317,25 @@ class Utils:
 
     if (http or https) and not Utils.space(text):
       try:
-        if Utils.get_url_type(text) == "text/html":
-          with urlopen(Utils.request(text)) as r:
-            html = r.read().decode("utf-8")
-            parser = Utils.TitleParser()
-            parser.feed(html)
-            return parser.title
+        with urlopen(Utils.request(text)) as r:
+          if r.headers.get_content_type() != "text/html":
+            return ""
+
+          charset = r.headers.get_content_charset() or "utf-8"
+          buf = b""
+
+          while len(buf) < TITLE_MAX_BYTES:
+            chunk = r.read(TITLE_CHUNK_SIZE)
+
+            if not chunk:
+              break
+
+            buf += chunk
+            match = _RE_TITLE.search(buf)
+
+            if match:
+              title = match.group(1).decode(charset, errors="replace")
+              return html.unescape(title).replace("\n", "").strip()
       except Exception as e:
         Utils.msg(f"Title Exception: {e}")
 
@@ -297,12 +344,12 @@ class Utils:
   # Copy text to the clipboard
   @staticmethod
   def copy_text(text: str) -> None:
-    Utils.run("xclip -sel clip -f", text, timeout=CMD_TIMEOUT)
+    Utils.run(["xclip", "-sel", "clip", "-f"], text, timeout=CMD_TIMEOUT)
 
   # Read the clipboard
   @staticmethod
   def read_clipboard() -> str:
-    ans = Utils.run("xclip -o -sel clip", timeout=CMD_TIMEOUT)
+    ans = Utils.run(["xclip", "-o", "-sel", "clip"], timeout=CMD_TIMEOUT)
 
     if ans.code == 0:
       return str(ans.text)
@@ -335,17 +382,49 @@ class Utils:
     return CmdOutput(text=stdout, code=proc.returncode)
 
   # Run a command without a shell
+  # The command is a list of arguments
   @staticmethod
-  def run(cmd: str, text: str = "", timeout: int = 0) -> CmdOutput:
-    args = cmd.split(" ")
-    proc = Popen(args, stdout=PIPE, stdin=PIPE, shell=False, text=True)
+  def run(cmd: List[str], text: str = "", timeout: int = 0) -> CmdOutput:
+    proc = Popen(cmd, stdout=PIPE, stdin=PIPE, shell=False, text=True)
     return Utils.exec(proc, text, timeout)
 
-  # Run a command using a shell
+  # Run a command without a shell
+  # The lines are encoded and written to its input as they are produced
+  # The input is a buffered binary pipe so small writes are grouped
   @staticmethod
-  def run_shell(cmd: str, text: str = "", timeout: int = 0) -> CmdOutput:
-    proc = Popen(cmd, stdout=PIPE, stdin=PIPE, shell=True, text=True)
-    return Utils.exec(proc, text, timeout)
+  def stream(cmd: List[str], lines: Iterable[str]) -> CmdOutput:
+    proc = Popen(cmd, stdout=PIPE, stdin=PIPE, shell=False, bufsize=-1)
+
+    if proc.stdin is None or proc.stdout is None:
+      return CmdOutput(text="", code=1)
+
+    try:
+      try:
+        for line in lines:
+          proc.stdin.write(line.encode("utf-8"))
+          proc.stdin.write(b"\n")
+
+        proc.stdin.close()
+      except BrokenPipeError:
+        # The command exited before reading all the lines
+        pass
+
+      stdout = proc.stdout.read().decode("utf-8", errors="replace")
+      proc.wait()
+    except Exception as e:
+      Utils.msg(f"Command Exception: {e}")
+
+      # Don't leave the command running with a partial input
+      try:
+        proc.stdin.close()
+      except OSError:
+        pass
+
+      proc.kill()
+      proc.wait()
+      return CmdOutput(text="", code=1)
+
+    return CmdOutput(text=stdout.strip(), code=proc.returncode)
 
   # Check if a program is installed
   @staticmethod
@@ -377,6 +456,35 @@ class Utils:
 #-----------------
 
 class Converters:
+  # Loaded converter modules by file name, with the file modification time
+  # This avoids executing the files (and compiling their regexes) on every copy
+  modules: Dict[str, Tuple[int, ModuleType]] = {}
+
+  # Load a converter module or get it from the cache
+  # A file that was edited since it was loaded is loaded again
+  @staticmethod
+  def load(file: str) -> ModuleType | None:
+    module_path = Path(Config.converters_path / file)
+    mtime = Files.mtime(module_path)
+    cached = Converters.modules.get(file)
+
+    if cached is not None and cached[0] == mtime:
+      return cached[1]
+
+    module_name = os.path.splitext(file)[0]
+    spec = importlib.util.spec_from_file_location(module_name, module_path)
+
+    if spec is None:
+      return None
+
+    if spec.loader is None:
+      return None
+
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    Converters.modules[file] = (mtime, module)
+    return module
+
   @staticmethod
   # Load all the converters and run them
   def convert(text: str) -> str:
@@ -384,19 +492,11 @@ class Converters:
     py_files = [file for file in files if file.endswith(".py")]
 
     for file in py_files:
-      module_name = os.path.splitext(file)[0]
-      module_path = Path(Config.converters_path / file)
-      spec = importlib.util.spec_from_file_location(module_name, module_path)
+      module = Converters.load(file)
 
-      if spec is None:
+      if module is None:
         return ""
 
-      if spec.loader is None:
-        return ""
-
-      module = importlib.util.module_from_spec(spec)
-      spec.loader.exec_module(module)
-
       if hasattr(module, "convert") and callable(module.convert):
         new_text = module.convert(text)
 
@@ -429,40 +529,43 @@ class TextData:
 class Rofi:
   # Get the style for the Rofi menu
   @staticmethod
-  def style() -> str:
-    return f'-me-select-entry "" -me-accept-entry "MousePrimary"' \
-    f' -theme-str "window {{width: calc(100% min {Settings.rofi_width});}}"' \
-    f'' if not Settings.rofi_style else f'-theme {Settings.rofi_style}'
+  def style() -> List[str]:
+    if Settings.rofi_style:
+      return ["-theme", Settings.rofi_style]
 
-  # Get a Rofi prompt
+    return ["-me-select-entry", "", "-me-accept-entry", "MousePrimary",
+    "-theme-str", f"window {{width: calc(100% min {Settings.rofi_width});}}"]
+
+  # Get the Rofi command for a prompt
   @staticmethod
-  def prompt(s: str) -> str:
-    return f'rofi -inputchange-action "kb-row-first" -dmenu -markup-rows -i -p "{s}"'
+  def prompt(s: str) -> List[str]:
+    return ["rofi", "-inputchange-action", "kb-row-first", "-dmenu", "-markup-rows", "-i", "-p", s]
+
+  # Newlines become asterisks and runs of spaces become one space
+  @staticmethod
+  def normalize(match: re.Match[str]) -> str:
+    return _ASTERISK if match.group(1) else " "
 
   # Show the Rofi menu with the items
   @staticmethod
   def show(selected: int = 0) -> None:
-    opts: List[str] = []
-    asterisk = "<span> * </span>"
-
-    for item in Items.items:
-      line = item.text.strip()
-      line = html.escape(line)
-      line = re.sub(" *\n *", "\n", line)
-      line = line.replace("\n", asterisk)
-      line = re.sub(" +", " ", line)
-      line = re.sub("</span> +", "</span>", line)
-      line += Rofi.get_title(item)
-      opt_str = Rofi.get_info(item)
-      text_data = TextData.get(item)
-      line = Rofi.remove(item, line, text_data)
-      opt_str += Rofi.get_icon(item, line, text_data)
-      opts.append(opt_str)
+    # Produce the menu lines one by one
+    def opts() -> Iterator[str]:
+      for item in Items.items:
+        if item.cached_line is None:
+          line = item.text.strip()
+          line = _RE_NORMALIZE.sub(Rofi.normalize, line.translate(_ESCAPE_TABLE))
+          line += Rofi.get_title(item)
+          text_data = TextData.get(item)
+          line = Rofi.remove(item, line, text_data)
+          item.cached_line = Rofi.get_icon(item, line, text_data)
+
+        yield Rofi.get_info(item) + item.cached_line
 
     p = []
 
     if Settings.show_name:
-      p.append(f"Clipton v{VERSION}")
+      p.append(_PROMPT_NAME)
 
     if Settings.show_num_items:
       num_items = len(Items.items)
@@ -475,11 +578,11 @@ class Rofi:
       p.append(num)
 
     if Settings.show_shortcuts:
-      p.append("Alt+1 Delete | Alt+(2-9) Join | Alt+0 Clear")
+      p.append(_PROMPT_SHORTCUTS)
 
-    prompt = Rofi.prompt(" | ".join(p))
-    prompt = f"{prompt} -format i {Rofi.style()} -selected-row {selected}"
-    ans = Utils.run_shell(prompt, "\n".join(opts))
+    cmd = Rofi.prompt(" | ".join(p))
+    cmd += ["-format", "i", *Rofi.style(), "-selected-row", str(selected)]
+    ans = Utils.stream(cmd, opts())
 
     if ans.text:
       code = ans.code
@@ -529,13 +632,10 @@ class Rofi:
   @staticmethod
   def get_title(item: "Item") -> str:
     if item.title:
-      title = ""
-      title = item.title
-
-      if title:
-        title = title.replace("\n", "").strip()
-        title = html.escape(title)
-        return f" <b>({title})</b>"
+      # Titles saved by older versions can contain newlines
+      title = item.title.replace("\n", "").strip()
+      title = title.translate(_ESCAPE_TABLE)
+      return f" <b>({title})</b>"
 
     return ""
 
@@ -546,9 +646,9 @@ class Rofi:
       removed = ""
 
       if Settings.remove_www:
-        removed += re.sub(r"^(https?://(www\.)?)", "", line)
+        removed += _RE_HTTP_WWW.sub("", line)
       else:
-        removed += re.sub(r"^(https?://)", "", line)
+        removed += _RE_HTTP.sub("", line)
 
       if removed:
         line = removed
@@ -598,14 +698,16 @@ class Item:
   num_lines: int
   title: str
 
+  # The rendered Rofi line without the info part
+  # It's not saved and it's reset when the title changes
+  cached_line: str | None = None
+
   # Create an item from a JSON object
+  # The parsed dictionary is used directly as the attribute dictionary
   @staticmethod
   def from_json(obj: Dict[str, Any]) -> "Item":
-    item = Item()
-    item.text = obj["text"]
-    item.date = obj["date"]
-    item.num_lines = obj["num_lines"]
-    item.title = obj["title"]
+    item = Item.__new__(Item)
+    item.__dict__ = obj
     return item
 
   # Create an item from text
@@ -620,21 +722,219 @@ class Item:
 
   # Convert an item to a dictionary
   def to_dict(self) -> Dict[str, Any]:
-    return self.__dict__
+    return {
+      "text": self.text,
+      "date": self.date,
+      "num_lines": self.num_lines,
+      "title": self.title,
+    }
 
 class Items:
   # List with all the items
   items: List[Item] = []
 
+  # The same items by text, to find duplicates without scanning the list
+  index: Dict[str, Item] = {}
+
+  # Changes to the item list that are not saved yet, in order
+  # Each change is a dictionary with an "op" key:
+  # add: Put "item" at the top, replacing the item with the same text
+  # del: Remove the item with "text"
+  # title: Set the "title" of the item with "text"
+  # clear: Remove all the items
+  changes: List[Dict[str, Any]] = []
+
+  # If the item list has changes that are not saved yet
+  dirty = False
+
+  # Monotonic time in seconds of the last write to the items files
+  last_flush = 0.0
+
+  # Minimum time in seconds between writes of the items files
+  flush_delay = 1.0
+
+  # Number of changes in the log file
+  log_size = 0
+
+  # When the log file would get more changes than this
+  # the items file is rewritten and the log is emptied
+  max_log = 200
+
+  # Modification times of the items files when they were last read or written
+  mtime: Tuple[int, int] = (0, 0)
+
+  # Get the modification times of the items file and the log file
+  @staticmethod
+  def get_mtime() -> Tuple[int, int]:
+    return (Files.mtime(Config.items_path), Files.mtime(Config.log_path))
+
+  # Check if another process changed the items files
+  @staticmethod
+  def changed() -> bool:
+    return Items.get_mtime() != Items.mtime
+
   # Read the items file and fill the item list
+  # Then apply the changes from the log file on top
   @staticmethod
   def read() -> None:
-    Items.items = Files.read_json(Config.items_path, Item.from_json)
+    data = Files.read_json(Config.items_path)
+    from_json = Item.from_json
+    Items.items = [from_json(obj) for obj in data]
+    Items.reindex()
+
+    # The old log only exists if a rewrite of the items file was interrupted
+    Items.replay(Config.old_log_path)
+    Items.log_size = Items.replay(Config.log_path)
+    Items.mtime = Items.get_mtime()
+    Items.changes = []
+    Items.dirty = False
+
+  # Apply the changes from a log file, skipping the first lines
+  # Return the number of lines in the file
+  @staticmethod
+  def replay(path: Path, skip: int = 0) -> int:
+    if not path.exists():
+      return 0
+
+    lines = Files.read(path).splitlines()
+
+    for line in lines[skip:]:
+      try:
+        change = json.loads(line)
+      except json.JSONDecodeError:
+        # A line cut short by a crash
+        continue
+
+      Items.apply(change)
+
+    return len(lines)
+
+  # Rebuild the text index from the item list
+  @staticmethod
+  def reindex() -> None:
+    Items.index = {item.text: item for item in Items.items}
+
+  # Read the items files again if they were changed by another process
+  # Pending changes are saved to the log first so they are not lost
+  @staticmethod
+  def reload() -> None:
+    if Items.changed():
+      Items.append()
+      Items.read()
+
+  # Apply a change to the item list
+  @staticmethod
+  def apply(change: Dict[str, Any]) -> None:
+    op = change["op"]
+
+    if op == "add":
+      item = Item.from_json(dict(change["item"]))
+      old = Items.index.get(item.text)
+      Items.index[item.text] = item
+
+      if old is None:
+        Items.items.insert(0, item)
+
+        for trimmed in Items.items[Settings.max_items:]:
+          Items.index.pop(trimmed.text, None)
+
+        del Items.items[Settings.max_items:]
+      elif Items.items[0] is old:
+        # Copying the newest item again doesn't need to move it
+        Items.items[0] = item
+      else:
+        Items.items.remove(old)
+        Items.items.insert(0, item)
+
+    elif op == "del":
+      removed = Items.index.pop(change["text"], None)
+
+      if removed is not None:
+        Items.items.remove(removed)
+
+    elif op == "title":
+      target = Items.index.get(change["text"])
+
+      if target is not None:
+        target.title = change["title"]
+        target.cached_line = None
+
+    elif op == "clear":
+      Items.items = []
+      Items.index = {}
+
+  # Apply a change and remember it so it gets saved
+  @staticmethod
+  def change(change: Dict[str, Any]) -> None:
+    Items.apply(change)
+    Items.changes.append(change)
+    Items.dirty = True
 
   # Stringify the JSON object and save it in the items file
+  # The log file is moved aside first, so changes another process appends
+  # meanwhile go to a new log instead of being lost
+  # Changes that reached the old log after the last read are applied
+  # and the old log is removed once the items file has every change
   @staticmethod
   def write() -> None:
-    Files.write_json(Config.items_path, Items.items, Item.to_dict)
+    if Config.log_path.exists():
+      os.replace(Config.log_path, Config.old_log_path)
+      Items.replay(Config.old_log_path, Items.log_size)
+
+    Files.write_json(Config.items_path, [item.to_dict() for item in Items.items])
+    Config.old_log_path.unlink(missing_ok=True)
+    Items.after_write()
+    Items.log_size = 0
+
+  # Add the pending changes to the end of the log file
+  @staticmethod
+  def append() -> None:
+    if not Items.changes:
+      return
+
+    external = Items.changed()
+    lines = [json.dumps(change, separators=(",", ":")) + "\n" for change in Items.changes]
+    Files.append(Config.log_path, "".join(lines))
+    Items.log_size += len(lines)
+
+    if external:
+      # Keep the old times so the changes of the other process get read
+      Items.changes = []
+      Items.dirty = False
+      Items.last_flush = time.monotonic()
+    else:
+      Items.after_write()
+
+  # Update the state after saving
+  @staticmethod
+  def after_write() -> None:
+    Items.mtime = Items.get_mtime()
+    Items.last_flush = time.monotonic()
+    Items.changes = []
+    Items.dirty = False
+
+  # Save the pending changes
+  # Usually they are added to the log, once it gets too long the items file
+  # is rewritten. That's only done when no other process changed the files
+  @staticmethod
+  def save() -> None:
+    if (Items.log_size + len(Items.changes) > Items.max_log) and not Items.changed():
+      Items.write()
+    else:
+      Items.append()
+
+  # Save the items if there are unsaved changes
+  @staticmethod
+  def flush() -> None:
+    if Items.dirty:
+      Items.save()
+
+  # Save the items if there are unsaved changes
+  # and enough time has passed since the last write
+  @staticmethod
+  def maybe_flush() -> None:
+    if Items.dirty and (time.monotonic() - Items.last_flush > Items.flush_delay):
+      Items.save()
 
   # When an item is selected through the Rofi menu
   @staticmethod
@@ -645,22 +945,20 @@ class Items:
   # Delete an item from the item list
   @staticmethod
   def delete(index: int) -> None:
-    del Items.items[index]
-    Items.write()
+    Items.change({"op": "del", "text": Items.items[index].text})
 
   # Delete all the items
   @staticmethod
   def delete_all() -> None:
-    Items.items = []
-    Items.write()
+    Items.change({"op": "clear"})
 
   # Delete all items
   @staticmethod
   def confirm_delete() -> None:
     opts = ["No", "Yes"]
-    prompt = Rofi.prompt("Delete all items?")
-    prompt = f"{prompt} {Rofi.style()} -selected-row 0"
-    ans = Utils.run_shell(prompt, "\n".join(opts))
+    cmd = Rofi.prompt("Delete all items?")
+    cmd += [*Rofi.style(), "-selected-row", "0"]
+    ans = Utils.run(cmd, "\n".join(opts))
 
     if ans.text == "Yes":
       Items.delete_all()
@@ -676,40 +974,45 @@ class Items:
       item_slice = Items.items[index:index_2]
 
     s = " ".join(item.text.strip() for item in item_slice)
-    del Items.items[index:index_2]
+
+    # Keep the items if the joined text can't be added
+    if not Items.can_add(s):
+      return
+
+    for item in item_slice:
+      Items.change({"op": "del", "text": item.text})
 
     if Items.add(s):
-      Items.write()
       Utils.copy_text(s)
 
-  # Add an item to the item list
-  # It performs some checks
-  # It removes duplicates
+  # Check if a text can be added to the item list
   @staticmethod
-  def add(text: str) -> bool:
+  def can_add(text: str) -> bool:
     if not text:
       return False
 
     if len(text) > Settings.heavy_paste:
       return False
 
-    item_exists = False
+    return True
+
+  # Add an item to the item list
+  # It performs some checks
+  # It removes duplicates
+  @staticmethod
+  def add(text: str) -> bool:
+    if not Items.can_add(text):
+      return False
 
-    for item in Items.items:
-      if item.text == text:
-        the_item = item
-        item_exists = True
-        Items.items.remove(the_item)
-        break
+    the_item = Items.index.get(text)
 
-    if not item_exists:
-      the_item = Item.from_text(text)
+    if the_item is None:
+      obj = Item.from_text(text).to_dict()
     else:
-      the_item.date = Utils.get_seconds()
+      obj = the_item.to_dict()
+      obj["date"] = Utils.get_seconds()
 
-    Items.items.insert(0, the_item)
-    Items.items = Items.items[0:Settings.max_items]
-    Items.write()
+    Items.change({"op": "add", "item": obj})
     return True
 
   # Insert an item into the item list
@@ -753,34 +1056,28 @@ class Items:
     if not Settings.enable_titles:
       return
 
-    for item in Items.items:
-      if item.text == text:
-        if item.title:
-          return
+    item = Items.index.get(text)
 
-        title = Utils.get_title(text)
+    if item is None or item.title:
+      return
 
-        if title:
-          item.title = title
+    title = Utils.get_title(text)
 
-        Items.write()
-        break
+    if title:
+      Items.change({"op": "title", "text": text, "title": title})
 
   # Remove unwanted items
   @staticmethod
   def clean() -> None:
-    keep = []
+    remove = []
 
     for index, item in enumerate(Items.items):
       if item.text.startswith(ORIGINAL):
         if index != 1:
-          continue
-
-      keep.append(item)
+          remove.append(item.text)
 
-    if len(Items.items) != len(keep):
-      Items.items = keep
-      Items.write()
+    for text in remove:
+      Items.change({"op": "del", "text": text})
 
   # Show the Rofi menu
   @staticmethod
@@ -800,36 +1097,101 @@ class Watcher:
   # Time interval in seconds to check the clipboard
   sleep_time = 0.666
 
-  # Start the clipboard watcher
-  # This is a loop that checks the clipboard periodically
-  # It detects clipboard changes and adds to the item list
+  # Maximum time in seconds to wait after repeated errors
+  max_backoff = 30
+
+  # Number of errors in a row
+  errors = 0
+
+  # Check the clipboard once and add the text if it changed
   @staticmethod
-  def start() -> None:
-    Utils.need("xclip")
-    Watcher.last_clip = Utils.read_clipboard()
-    Utils.msg("Watcher Started")
+  def check() -> None:
+    clip = Utils.read_clipboard()
 
-    while True:
-      clip = Utils.read_clipboard()
+    if clip and (clip != Watcher.last_clip):
+      Watcher.last_clip = clip
+
+      if clip.startswith("file://"):
+        return
+
+      if clip.startswith(ORIGINAL):
+        return
 
-      if clip and (clip != Watcher.last_clip):
-        Watcher.last_clip = clip
+      if len(clip) > Settings.heavy_paste:
+        return
 
-        if clip.startswith("file://"):
-          continue
+      Items.reload()
+      Items.insert(clip)
 
-        if clip.startswith(ORIGINAL):
-          continue
+  # Check the clipboard (if needed) and save pending changes
+  # Errors are printed and the watcher keeps going, waiting longer
+  # each time the errors repeat
+  @staticmethod
+  def step(check: bool = True) -> None:
+    try:
+      if check:
+        Watcher.check()
 
-        if len(clip) > Settings.heavy_paste:
-          continue
+      Items.maybe_flush()
+      Watcher.errors = 0
+    except Exception as e:
+      Watcher.errors += 1
+      Utils.msg(f"Watcher Exception: {e}")
+      time.sleep(min(Watcher.max_backoff, 2 ** Watcher.errors))
 
-        Items.read()
-        Items.insert(clip)
+  # Check the clipboard every time clipnotify reports a change
+  # A single clipnotify process is kept running for all the events
+  # Returns if clipnotify exits
+  @staticmethod
+  def listen() -> None:
+    proc = Popen(["clipnotify", "-s", "clipboard", "-l"], stdout=PIPE)
+
+    if proc.stdout is None:
+      return
+
+    fd = proc.stdout.fileno()
+
+    try:
+      while True:
+        ready, _, _ = select.select([fd], [], [], Items.flush_delay)
+
+        if ready:
+          # One read can hold several events, one check covers them all
+          if not os.read(fd, 4096):
+            break
+
+          Watcher.step()
+        else:
+          Watcher.step(check=False)
+    finally:
+      proc.kill()
+      proc.wait()
+
+  # Check the clipboard periodically
+  @staticmethod
+  def poll() -> None:
+    while True:
+      Watcher.step()
 
       # Very important
       time.sleep(Watcher.sleep_time)
 
+  # Start the clipboard watcher
+  # It detects clipboard changes and adds to the item list
+  # It uses clipnotify if it's installed, else it polls the clipboard
+  @staticmethod
+  def start() -> None:
+    Utils.need("xclip")
+    Watcher.last_clip = Utils.read_clipboard()
+    Items.read()
+    Utils.msg("Watcher Started")
+
+    if shutil.which("clipnotify") is not None:
+      Watcher.listen()
+      Utils.msg("clipnotify exited, polling the clipboard instead")
+
+    Watcher.poll()
+
 #-----------------
 # MAIN
 #-----------------
@@ -841,6 +1203,11 @@ def main() -> None:
 
   Config.setup()
   Settings.read()
+
+  # Save pending item changes before exiting
+  atexit.register(Items.flush)
+  signal.signal(signal.SIGTERM, lambda signum, frame: exit(0))
+
   mode = "show"
 
   if len(sys.argv) > 1:
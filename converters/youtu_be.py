@@ -1,9 +1,10 @@
 import re
 
+_RE_YOUTU_BE = re.compile(r"^https://youtu\.be/(?P<video_id>[\w-]+)(\?t=(?P<timestamp>\d+))?[^ \n]*$")
+
 # Convert a youtu.be URL to a YouTube URL
 def convert(text: str) -> str:
-	regex = re.compile(r"^https:\/\/youtu.be\/(?P<video_id>[\w-]+)(\?t=(?P<timestamp>[\d]+))?[^ \n]*$")
-	match = regex.search(text)
+	match = _RE_YOUTU_BE.search(text)
 
 	if match and match.group("video_id"):
 		video_id = match.group("video_id")
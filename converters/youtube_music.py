@@ -1,21 +1,20 @@
 import re
 
+_RE_YT_MUSIC = re.compile(r"^https://music\.youtube\.com/(?:watch\?v=(?P<video_id>[\w-]+)|playlist\?list=(?P<list_id>[\w-]+))[^ \n]*$")
+
 # Convert a YouTube Music URL to a YouTube URL
 def convert(text: str) -> str:
-	if "watch?v" in text:
-		regex = re.compile("^https:\/\/music\.youtube\.com\/watch\?v=(?P<video_id>[\w-]+)[^ \n]*$")
-		match = regex.search(text)
+	match = _RE_YT_MUSIC.search(text)
 
-		if match and match.group("video_id"):
-			arg = match.group("video_id")
-			return f"https://www.youtube.com/watch?v={arg}"
+	if not match:
+		return ""
 
-	if "playlist?list" in text:
-		regex = re.compile("^https:\/\/music\.youtube\.com\/playlist\?list=(?P<list_id>[\w-]+)[^ \n]*$")
-		match = regex.search(text)
+	if match.group("video_id"):
+		arg = match.group("video_id")
+		return f"https://www.youtube.com/watch?v={arg}"
 
-		if match and match.group("list_id"):
-			arg = match.group("list_id")
-			return f'https://www.youtube.com/playlist?list={arg}'
+	if match.group("list_id"):
+		arg = match.group("list_id")
+		return f'https://www.youtube.com/playlist?list={arg}'
 
 	return ""
\ No newline at end of file